@@ -1,30 +1,314 @@
 """Core Agent Definitions for Intelligent Agent System"""
 
-from typing import Any, Dict
+import asyncio
+import os
+import re
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
 from abc import ABC, abstractmethod
+import httpx
+import orjson
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI
 from config import settings
+from llm_cache import CachedLLM, cache_key, get_or_fetch, is_truncated, normalize_prompt
 from logger import track_agent_performance, logger
+from parallel_scheduler import ScheduledLLM, budgeted, count_tokens
+
+
+_WORD_RE = re.compile(r"\S+")
+
+# Characters of analysis input kept in serialized summaries
+SUMMARY_LEN = 200
+
+# Sized for concurrent batch workflows sharing one client
+_POOL_LIMITS = httpx.Limits(max_keepalive_connections=64, max_connections=128)
+
+
+@lru_cache(maxsize=8)
+def _get_llm(model: str, temperature: float, max_tokens: int, api_key: str,
+             max_retries: int = 2) -> ChatOpenAI:
+    """Get a shared chat model so agents reuse one connection pool"""
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        api_key=api_key,
+        max_retries=max_retries,
+        http_client=httpx.Client(limits=_POOL_LIMITS),
+        http_async_client=httpx.AsyncClient(limits=_POOL_LIMITS)
+    )
+
+
+@dataclass(slots=True)
+class AgentResult:
+    """Base class for agent outputs"""
+    elapsed_ms: float = field(default=0.0, kw_only=True)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize for history files"""
+        record = asdict(self)
+        # Stamped only after the result is persisted; workflow stats carry stage timings
+        del record["elapsed_ms"]
+        return record
+
+
+@dataclass(slots=True)
+class ResearchResult(AgentResult):
+    topic: str
+    findings: str
+    research_type: str
+
+
+@dataclass(slots=True)
+class AnalysisResult(AgentResult):
+    # Full input kept by reference; only the summary slice is ever serialized
+    input_data: str = field(repr=False)
+    insights: str
+    confidence_score: float
+    
+    @property
+    def input_summary(self) -> str:
+        return self.input_data[:SUMMARY_LEN]
+    
+    def to_dict(self) -> Dict[str, Any]:
+        record = AgentResult.to_dict(self)
+        record["input_summary"] = record.pop("input_data")[:SUMMARY_LEN]
+        return record
+
+
+@dataclass(slots=True)
+class WriterReport(AgentResult):
+    report_type: str
+    content: str
+    word_count: int
+    status: str
+
+
+@dataclass(slots=True)
+class ReviewResult(AgentResult):
+    status: str
+    quality_assessment: str
+    quality_score: float
+    approved: bool
 
 
 class BaseAgent(ABC):
     """Base class for all agents"""
     
+    __slots__ = (
+        "name", "description", "llm", "scheduled_llm", "cache", "semantic_cache", "_sink"
+    )
+    
+    # Static prompt text around the input, set by each agent
+    _prompt_prefix = ""
+    _prompt_suffix = ""
+    _static_prompt_tokens = 0
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._static_prompt_tokens = (
+            count_tokens(cls._prompt_prefix) + count_tokens(cls._prompt_suffix)
+        )
+    
     def __init__(self, name: str, description: str):
         self.name = name
         self.description = description
-        self.llm = ChatOpenAI(
-            model=settings.model_name,
-            temperature=settings.temperature,
-            max_tokens=settings.max_tokens,
-            api_key=settings.openai_api_key
+        self.llm = _get_llm(
+            settings.model_name,
+            settings.temperature,
+            settings.max_tokens,
+            settings.openai_api_key
+        )
+        # The scheduler retries 429s and transient errors itself, so its client must not
+        self.scheduled_llm = ScheduledLLM(self.llm, _get_llm(
+            settings.model_name,
+            settings.temperature,
+            settings.max_tokens,
+            settings.openai_api_key,
+            0
+        ))
+        self.cache = CachedLLM(self.scheduled_llm) if settings.enable_cache else None
+        self.semantic_cache = None
+        if settings.enable_semantic_cache:
+            from semantic_cache import SemanticCache
+            self.semantic_cache = SemanticCache(namespace=name)
+        
+        os.makedirs(settings.history_dir, exist_ok=True)
+        self._sink = open(
+            os.path.join(settings.history_dir, f"{name}.jsonl"), "ab", buffering=1 << 16
         )
     
+    def persist(self, result: AgentResult):
+        """Append an output to the agent's JSONL history file"""
+        self._sink.write(orjson.dumps(result.to_dict()) + b"\n")
+    
+    def close(self):
+        """Flush and close the history file"""
+        self._sink.close()
+    
+    def cached_invoke(self, input_data: str):
+        """Invoke the LLM for an input, serving identical or near-duplicate inputs from cache"""
+        prompt = self.build_prompt(input_data)
+        prompt_tokens = self.prompt_tokens(input_data)
+        semantic_cache = self.semantic_cache
+        # The namespace is per agent, so the input alone identifies the prompt
+        text = normalize_prompt(input_data)
+        if semantic_cache is None or not semantic_cache.fits(text):
+            return self._invoke_exact(prompt, prompt_tokens)
+        
+        vector = semantic_cache.embed(text)
+        content = semantic_cache.lookup(vector)
+        if content is not None:
+            return AIMessage(content=content)
+        
+        response = self._invoke_exact(prompt, prompt_tokens)
+        if not is_truncated(response):
+            semantic_cache.add(vector, response.content, {"agent": self.name})
+        return response
+    
+    async def acached_invoke(self, input_data: str):
+        """Async variant of cached_invoke that embeds off the event loop"""
+        prompt = self.build_prompt(input_data)
+        prompt_tokens = self.prompt_tokens(input_data)
+        semantic_cache = self.semantic_cache
+        text = normalize_prompt(input_data)
+        if semantic_cache is None or not semantic_cache.fits(text):
+            return await self._ainvoke_exact(prompt, prompt_tokens)
+        
+        vector = await asyncio.to_thread(semantic_cache.embed, text)
+        content = semantic_cache.lookup(vector)
+        if content is not None:
+            return AIMessage(content=content)
+        
+        response = await self._ainvoke_exact(prompt, prompt_tokens)
+        if not is_truncated(response):
+            semantic_cache.add(vector, response.content, {"agent": self.name})
+        return response
+    
+    def _invoke_exact(self, prompt: str, prompt_tokens: int = 0):
+        """Invoke the LLM through the exact-match cache when enabled"""
+        if self.cache is None:
+            return self.invoke_safely(prompt, prompt_tokens)
+        return self.cache.invoke(prompt, prompt_tokens=prompt_tokens)
+    
+    def invoke_safely(self, prompt: str, prompt_tokens: int = 0):
+        """Invoke the LLM with max_tokens shrunk to fit the model's context window"""
+        return self.scheduled_llm.invoke(prompt, prompt_tokens=prompt_tokens)
+    
+    async def _ainvoke_exact(self, prompt: str, prompt_tokens: int = 0):
+        """Async variant of _invoke_exact"""
+        if self.cache is None:
+            return await get_or_fetch(
+                cache_key(normalize_prompt(prompt)),
+                lambda: self.scheduled_llm.ainvoke(prompt, prompt_tokens=prompt_tokens)
+            )
+        return await self.cache.ainvoke(prompt, prompt_tokens=prompt_tokens)
+    
+    def stream_execute(self, prompt: str) -> Iterator[str]:
+        """Stream response chunks for a prompt, serving a cache hit as one chunk"""
+        prompt = normalize_prompt(prompt)
+        key = cache_key(prompt)
+        
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached.content
+                return
+        
+        parts = []
+        truncated = False
+        for chunk in budgeted(self.llm, count_tokens(prompt)).stream(prompt):
+            parts.append(chunk.content)
+            truncated = truncated or is_truncated(chunk)
+            yield chunk.content
+        
+        if self.cache is not None and not truncated:
+            self.cache.put(key, "".join(parts))
+    
+    @track_agent_performance()
+    def execute_many(self, inputs: List[str]) -> List[Optional[AgentResult]]:
+        """Execute the agent task for several inputs with one batched LLM call, None where it failed"""
+        logger.logger.info("%s processing batch of %d inputs", self.name, len(inputs))
+        
+        prompts = [normalize_prompt(self.build_prompt(input_data)) for input_data in inputs]
+        keys = [cache_key(prompt) for prompt in prompts]
+        contents = [None] * len(prompts)
+        
+        if self.cache is not None:
+            for i, key in enumerate(keys):
+                cached = self.cache.get(key)
+                if cached is not None:
+                    contents[i] = cached.content
+        
+        # Identical prompts in the batch share one request
+        misses: Dict[str, List[int]] = {}
+        for i, content in enumerate(contents):
+            if content is None:
+                misses.setdefault(keys[i], []).append(i)
+        
+        if misses:
+            firsts = [indices[0] for indices in misses.values()]
+            # Each prompt gets its own max_tokens; a failed prompt only fails its own inputs
+            responses = RunnableLambda(self._invoke_budgeted).batch(
+                [prompts[i] for i in firsts],
+                config={"max_concurrency": settings.num_concurrent},
+                return_exceptions=True
+            )
+            for (key, indices), response in zip(misses.items(), responses):
+                if isinstance(response, Exception):
+                    logger.log_error(self.name, response, context=f"batch of {len(inputs)} inputs")
+                    continue
+                for i in indices:
+                    contents[i] = response.content
+                if self.cache is not None and not is_truncated(response):
+                    self.cache.put(key, response.content)
+        
+        results = []
+        for input_data, content in zip(inputs, contents):
+            if content is None:
+                results.append(None)
+                continue
+            result = self.build_result(input_data, content)
+            self.record(result)
+            results.append(result)
+        return results
+    
+    def _invoke_budgeted(self, prompt: str):
+        """Invoke the model with max_tokens sized for this prompt alone"""
+        return budgeted(self.llm, count_tokens(prompt)).invoke(prompt)
+    
+    def build_prompt(self, input_data: str) -> str:
+        """Build the LLM prompt for an input"""
+        return self._prompt_prefix + input_data + self._prompt_suffix
+    
+    def prompt_tokens(self, input_data: str) -> int:
+        """Count prompt tokens, tokenizing only the dynamic input"""
+        return self._static_prompt_tokens + count_tokens(input_data)
+    
     @abstractmethod
-    def execute(self, input_data: str) -> Dict[str, Any]:
+    def build_result(self, input_data: str, content: str) -> AgentResult:
+        """Build the agent output from an input and the LLM response"""
+        pass
+    
+    @abstractmethod
+    def record(self, result: AgentResult):
+        """Add an output to the agent's history and history file"""
+        pass
+    
+    @abstractmethod
+    def execute(self, input_data: str) -> AgentResult:
         """Execute agent task"""
         pass
     
+    @abstractmethod
+    async def aexecute(self, input_data: str) -> AgentResult:
+        """Execute agent task asynchronously"""
+        pass
+    
     @abstractmethod
     def validate_output(self, output: Any) -> bool:
         """Validate agent output"""
@@ -34,152 +318,232 @@ class BaseAgent(ABC):
 class ResearchAgent(BaseAgent):
     """Agent responsible for research and information gathering"""
     
+    __slots__ = ("research_history",)
+    
+    _prompt_prefix = "Research and provide comprehensive information about: "
+    _prompt_suffix = (
+        "\nInclude:"
+        "\n- Key findings"
+        "\n- Relevant data points"
+        "\n- Sources and references"
+    )
+    
     def __init__(self):
         super().__init__(
             name="ResearchAgent",
             description="Gathers and researches information on given topics"
         )
-        self.research_history = []
+        self.research_history = deque(maxlen=settings.history_max)
+    
+    def record(self, result: ResearchResult):
+        self.research_history.append(result)
+        self.persist(result)
+    
+    def build_result(self, input_data: str, content: str) -> ResearchResult:
+        return ResearchResult(
+            topic=input_data,
+            findings=content,
+            research_type="comprehensive"
+        )
     
     @track_agent_performance("ResearchAgent")
-    def execute(self, input_data: str) -> Dict[str, Any]:
+    def execute(self, input_data: str) -> ResearchResult:
         """Execute research task"""
-        logger.logger.info(f"Starting research on: {input_data}")
-        
-        # Simulate research processing
-        research_prompt = f"""Research and provide comprehensive information about: {input_data}
-        Include:
-        - Key findings
-        - Relevant data points
-        - Sources and references"""
-        
-        response = self.llm.invoke(research_prompt)
-        research_result = {
-            "topic": input_data,
-            "findings": response.content,
-            "research_type": "comprehensive"
-        }
-        
-        self.research_history.append(research_result)
+        logger.logger.info("Starting research on: %s", input_data)
+        
+        response = self.cached_invoke(input_data)
+        research_result = self.build_result(input_data, response.content)
+        
+        self.record(research_result)
+        return research_result
+    
+    @track_agent_performance("ResearchAgent")
+    async def aexecute(self, input_data: str) -> ResearchResult:
+        """Execute research task asynchronously"""
+        logger.logger.info("Starting research on: %s", input_data)
+        
+        response = await self.acached_invoke(input_data)
+        research_result = self.build_result(input_data, response.content)
+        
+        self.record(research_result)
         return research_result
     
     def validate_output(self, output: Any) -> bool:
-        return isinstance(output, dict) and "findings" in output
+        return isinstance(output, ResearchResult)
 
 
 class AnalysisAgent(BaseAgent):
     """Agent responsible for analyzing information"""
     
+    __slots__ = ("analysis_history",)
+    
+    _prompt_prefix = "Analyze the following information and provide:\n"
+    _prompt_suffix = (
+        "\n\nInclude:"
+        "\n- Key insights"
+        "\n- Pattern identification"
+        "\n- Recommendations"
+        "\n- Risk assessment"
+    )
+    
     def __init__(self):
         super().__init__(
             name="AnalysisAgent",
             description="Analyzes gathered information and identifies patterns"
         )
-        self.analysis_history = []
+        self.analysis_history = deque(maxlen=settings.history_max)
+    
+    def record(self, result: AnalysisResult):
+        self.analysis_history.append(result)
+        self.persist(result)
+    
+    def build_result(self, input_data: str, content: str) -> AnalysisResult:
+        return AnalysisResult(
+            input_data=input_data,
+            insights=content,
+            confidence_score=0.85
+        )
     
     @track_agent_performance("AnalysisAgent")
-    def execute(self, input_data: str) -> Dict[str, Any]:
+    def execute(self, input_data: str) -> AnalysisResult:
         """Execute analysis task"""
-        logger.logger.info(f"Analyzing data: {input_data[:100]}...")
+        logger.logger.info("Analyzing data: %.100s...", input_data)
         
-        analysis_prompt = f"""Analyze the following information and provide:
-        {input_data}
+        response = self.cached_invoke(input_data)
+        analysis_result = self.build_result(input_data, response.content)
         
-        Include:
-        - Key insights
-        - Pattern identification
-        - Recommendations
-        - Risk assessment"""
+        self.record(analysis_result)
+        return analysis_result
+    
+    @track_agent_performance("AnalysisAgent")
+    async def aexecute(self, input_data: str) -> AnalysisResult:
+        """Execute analysis task asynchronously"""
+        logger.logger.info("Analyzing data: %.100s...", input_data)
         
-        response = self.llm.invoke(analysis_prompt)
-        analysis_result = {
-            "input_summary": input_data[:200],
-            "insights": response.content,
-            "confidence_score": 0.85
-        }
+        response = await self.acached_invoke(input_data)
+        analysis_result = self.build_result(input_data, response.content)
         
-        self.analysis_history.append(analysis_result)
+        self.record(analysis_result)
         return analysis_result
     
     def validate_output(self, output: Any) -> bool:
-        return isinstance(output, dict) and "insights" in output
+        return isinstance(output, AnalysisResult)
 
 
 class WriterAgent(BaseAgent):
     """Agent responsible for creating written content"""
     
+    __slots__ = ("written_content",)
+    
+    _prompt_prefix = "Create a professional report based on:\n"
+    _prompt_suffix = (
+        "\n\nFormat:"
+        "\n- Executive Summary"
+        "\n- Detailed Findings"
+        "\n- Conclusions"
+        "\n- Next Steps"
+    )
+    
     def __init__(self):
         super().__init__(
             name="WriterAgent",
             description="Creates well-structured written reports and documents"
         )
-        self.written_content = []
+        self.written_content = deque(maxlen=settings.history_max)
+    
+    def record(self, result: WriterReport):
+        self.written_content.append(result)
+        self.persist(result)
+    
+    def build_result(self, input_data: str, content: str) -> WriterReport:
+        return WriterReport(
+            report_type="professional",
+            content=content,
+            word_count=sum(1 for _ in _WORD_RE.finditer(content)),
+            status="completed"
+        )
     
     @track_agent_performance("WriterAgent")
-    def execute(self, input_data: str) -> Dict[str, Any]:
+    def execute(self, input_data: str) -> WriterReport:
         """Execute writing task"""
-        logger.logger.info(f"Creating report for: {input_data[:100]}...")
-        
-        writing_prompt = f"""Create a professional report based on:
-        {input_data}
-        
-        Format:
-        - Executive Summary
-        - Detailed Findings
-        - Conclusions
-        - Next Steps"""
-        
-        response = self.llm.invoke(writing_prompt)
-        report = {
-            "report_type": "professional",
-            "content": response.content,
-            "word_count": len(response.content.split()),
-            "status": "completed"
-        }
-        
-        self.written_content.append(report)
+        logger.logger.info("Creating report for: %.100s...", input_data)
+        
+        response = self.cached_invoke(input_data)
+        report = self.build_result(input_data, response.content)
+        
+        self.record(report)
+        return report
+    
+    @track_agent_performance("WriterAgent")
+    async def aexecute(self, input_data: str) -> WriterReport:
+        """Execute writing task asynchronously"""
+        logger.logger.info("Creating report for: %.100s...", input_data)
+        
+        response = await self.acached_invoke(input_data)
+        report = self.build_result(input_data, response.content)
+        
+        self.record(report)
         return report
     
     def validate_output(self, output: Any) -> bool:
-        return isinstance(output, dict) and "content" in output
+        return isinstance(output, WriterReport)
 
 
 class ReviewAgent(BaseAgent):
     """Agent responsible for reviewing and quality checking"""
     
+    __slots__ = ("review_history",)
+    
+    _prompt_prefix = "Review the following content and provide quality assessment:\n"
+    _prompt_suffix = (
+        "\n\nEvaluate:"
+        "\n- Accuracy"
+        "\n- Clarity"
+        "\n- Completeness"
+        "\n- Professionalism"
+        "\n\nProvide improvement suggestions."
+    )
+    
     def __init__(self):
         super().__init__(
             name="ReviewAgent",
             description="Reviews and verifies quality of outputs"
         )
-        self.review_history = []
+        self.review_history = deque(maxlen=settings.history_max)
+    
+    def record(self, result: ReviewResult):
+        self.review_history.append(result)
+        self.persist(result)
+    
+    def build_result(self, input_data: str, content: str) -> ReviewResult:
+        return ReviewResult(
+            status="reviewed",
+            quality_assessment=content,
+            quality_score=0.92,
+            approved=True
+        )
     
     @track_agent_performance("ReviewAgent")
-    def execute(self, input_data: str) -> Dict[str, Any]:
+    def execute(self, input_data: str) -> ReviewResult:
         """Execute review task"""
-        logger.logger.info(f"Reviewing content quality")
-        
-        review_prompt = f"""Review the following content and provide quality assessment:
-        {input_data}
+        logger.logger.info("Reviewing content quality")
         
-        Evaluate:
-        - Accuracy
-        - Clarity
-        - Completeness
-        - Professionalism
+        response = self.cached_invoke(input_data)
+        review = self.build_result(input_data, response.content)
         
-        Provide improvement suggestions."""
+        self.record(review)
+        return review
+    
+    @track_agent_performance("ReviewAgent")
+    async def aexecute(self, input_data: str) -> ReviewResult:
+        """Execute review task asynchronously"""
+        logger.logger.info("Reviewing content quality")
         
-        response = self.llm.invoke(review_prompt)
-        review = {
-            "status": "reviewed",
-            "quality_assessment": response.content,
-            "quality_score": 0.92,
-            "approved": True
-        }
+        response = await self.acached_invoke(input_data)
+        review = self.build_result(input_data, response.content)
         
-        self.review_history.append(review)
+        self.record(review)
         return review
     
     def validate_output(self, output: Any) -> bool:
-        return isinstance(output, dict) and "quality_assessment" in output
+        return isinstance(output, ReviewResult)
@@ -0,0 +1,180 @@
+"""Offline workflow runs through the OpenAI Batch API"""
+
+import time
+from typing import Dict, List, Optional, Tuple
+import orjson
+from openai import OpenAI
+from agents import AgentResult
+from config import settings
+from llm_cache import cache_key, normalize_prompt
+from logger import logger, maybe_span, stamp_elapsed
+from orchestrator import WorkflowResult, advance_workflows
+from parallel_scheduler import completion_budget, count_tokens
+
+
+class BatchRunner:
+    """Runs multi-agent workflows as one OpenAI batch job per stage"""
+    
+    def __init__(self, orchestrator, client: OpenAI = None):
+        self.orchestrator = orchestrator
+        self.client = client or OpenAI(api_key=settings.openai_api_key)
+    
+    def _build_requests(self, stage: str, requests: Dict[int, Tuple[str, int]]) -> bytes:
+        """Encode (prompt, max_tokens) pairs as Batch API JSONL request lines"""
+        lines = []
+        for i, (prompt, max_tokens) in requests.items():
+            lines.append(orjson.dumps({
+                "custom_id": f"{i}-{stage}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": settings.model_name,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": settings.temperature,
+                    "max_tokens": max_tokens
+                }
+            }))
+        return b"\n".join(lines) + b"\n"
+    
+    def _wait(self, batch_id: str):
+        """Poll a batch until it reaches a terminal status"""
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status == "completed":
+                return batch
+            if batch.status in ("failed", "expired", "cancelled"):
+                raise RuntimeError(f"Batch {batch_id} ended with status: {batch.status}")
+            
+            logger.logger.info("Batch %s status: %s", batch_id, batch.status)
+            time.sleep(settings.batch_poll_seconds)
+    
+    def _read_output(self, batch, stage: str, indices: List[int]) -> Dict[int, dict]:
+        """Download batch output as completion choices by request index, skipping failed lines"""
+        choices = {}
+        if batch.output_file_id:
+            output = self.client.files.content(batch.output_file_id).text
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                record = orjson.loads(line)
+                response = record.get("response") or {}
+                if response.get("status_code") == 200:
+                    choices[record["custom_id"]] = response["body"]["choices"][0]
+        
+        missing = [i for i in indices if f"{i}-{stage}" not in choices]
+        if missing:
+            logger.logger.warning("Batch %s has no %s output for requests: %s", batch.id, stage, missing)
+        return {i: choices[f"{i}-{stage}"] for i in indices if f"{i}-{stage}" in choices}
+    
+    def run_stage(self, stage: str, agent, inputs: List[str]) -> List[Optional[AgentResult]]:
+        """Submit one stage's uncached inputs and build the agent outputs, None where one failed"""
+        prompts = [normalize_prompt(agent.build_prompt(input_data)) for input_data in inputs]
+        contents: List[Optional[str]] = [None] * len(prompts)
+        
+        # Prompts answered by a previous run are served from cache, not resubmitted
+        requests = {}
+        for i, prompt in enumerate(prompts):
+            if agent.cache is not None:
+                cached = agent.cache.get(cache_key(prompt))
+                if cached is not None:
+                    contents[i] = cached.content
+                    continue
+            try:
+                requests[i] = (prompt, completion_budget(count_tokens(prompt)))
+            except ValueError as e:
+                logger.log_error(agent.name, e, context=f"{stage} batch request {i}")
+        
+        if requests:
+            with maybe_span(f"Batch Stage - {stage}") as span:
+                input_file = self.client.files.create(
+                    file=(f"{stage}.jsonl", self._build_requests(stage, requests)),
+                    purpose="batch"
+                )
+                batch = self.client.batches.create(
+                    input_file_id=input_file.id,
+                    endpoint="/v1/chat/completions",
+                    completion_window="24h"
+                )
+                span.set_attribute("batch_id", batch.id)
+                logger.logger.info("Submitted %s batch %s with %d requests", stage, batch.id, len(requests))
+                
+                choices = self._read_output(self._wait(batch.id), stage, list(requests))
+            
+            for i, choice in choices.items():
+                contents[i] = choice["message"]["content"]
+                # Completions cut off at max_tokens would be served as complete answers
+                if agent.cache is not None and choice.get("finish_reason") != "length":
+                    agent.cache.put(cache_key(prompts[i]), contents[i])
+        
+        results = []
+        for input_data, content in zip(inputs, contents):
+            if content is None:
+                results.append(None)
+                continue
+            result = agent.build_result(input_data, content)
+            agent.record(result)
+            results.append(result)
+        return results
+    
+    def run(self, topics: List[str]) -> List[WorkflowResult]:
+        """Run complete workflows for all topics, one batch job per stage"""
+        if not topics:
+            return []
+        
+        orchestrator = self.orchestrator
+        workflow_start = time.perf_counter_ns()
+        workflow_ids = [orchestrator.new_workflow_id() for _ in topics]
+        
+        logger.logger.info("Starting Batch API run of %d workflows", len(topics))
+        
+        with maybe_span("Batch API Workflow", root=True) as batch_span:
+            batch_span.set_attribute("workflow_ids", workflow_ids)
+            
+            # (workflow_id, topic, stage results) for workflows still running
+            workflows = [(workflow_id, topic, []) for workflow_id, topic in zip(workflow_ids, topics)]
+            
+            stage_start = time.perf_counter_ns()
+            research_results = self.run_stage("research", orchestrator.research_agent, topics)
+            stamp_elapsed(research_results, (time.perf_counter_ns() - stage_start) / 1e6)
+            workflows = advance_workflows(workflows, research_results)
+            
+            stage_start = time.perf_counter_ns()
+            analysis_results = self.run_stage(
+                "analysis", orchestrator.analysis_agent,
+                [stages[-1].findings for _, _, stages in workflows]
+            )
+            stamp_elapsed(analysis_results, (time.perf_counter_ns() - stage_start) / 1e6)
+            workflows = advance_workflows(workflows, analysis_results)
+            
+            stage_start = time.perf_counter_ns()
+            writing_results = self.run_stage(
+                "writing", orchestrator.writer_agent,
+                [stages[-1].insights for _, _, stages in workflows]
+            )
+            stamp_elapsed(writing_results, (time.perf_counter_ns() - stage_start) / 1e6)
+            workflows = advance_workflows(workflows, writing_results)
+            
+            stage_start = time.perf_counter_ns()
+            review_results = self.run_stage(
+                "review", orchestrator.review_agent,
+                [stages[-1].content for _, _, stages in workflows]
+            )
+            stamp_elapsed(review_results, (time.perf_counter_ns() - stage_start) / 1e6)
+            workflows = advance_workflows(workflows, review_results)
+            
+            completed = {workflow_id for workflow_id, _, _ in workflows}
+            failed = [
+                topic for workflow_id, topic in zip(workflow_ids, topics) if workflow_id not in completed
+            ]
+            if failed:
+                logger.logger.warning(
+                    "%d of %d Batch API workflows failed: %s", len(failed), len(topics), failed
+                )
+            if not workflows:
+                return []
+            
+            total_time_ms = (time.perf_counter_ns() - workflow_start) / 1e6 / len(workflows)
+            return [
+                orchestrator.compile_workflow(workflow_id, topic, workflow_start, tuple(stages), total_time_ms)
+                for workflow_id, topic, stages in workflows
+            ]
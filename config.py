@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from pydantic import Field
 
@@ -19,15 +20,63 @@ class Settings(BaseSettings):
     # Agent Configuration
     enable_logging: bool = Field(default=True, env="ENABLE_LOGGING")
     log_level: str = Field(default="INFO", env="LOG_LEVEL")
+    logfire_sample_rate: float = Field(default=0.1, env="LOGFIRE_SAMPLE_RATE")
     
     # Performance Settings
     enable_metrics: bool = Field(default=True, env="ENABLE_METRICS")
     max_retries: int = Field(default=3, env="MAX_RETRIES")
     timeout_seconds: int = Field(default=30, env="TIMEOUT_SECONDS")
+    history_max: int = Field(default=100, env="HISTORY_MAX")
+    history_dir: str = Field(default="history", env="HISTORY_DIR")
+    num_concurrent: int = Field(default=4, env="NUM_CONCURRENT")
+    max_requests_per_minute: int = Field(default=500, env="MAX_REQUESTS_PER_MINUTE")
+    max_tokens_per_minute: int = Field(default=40000, env="MAX_TOKENS_PER_MINUTE")
+    batch_poll_seconds: int = Field(default=30, env="BATCH_POLL_SECONDS")
+    
+    # Cache Settings
+    enable_cache: bool = Field(default=True, env="ENABLE_CACHE")
+    cache_path: str = Field(default=".llm_cache.sqlite", env="CACHE_PATH")
+    enable_semantic_cache: bool = Field(default=False, env="ENABLE_SEMANTIC_CACHE")
+    semantic_cache_threshold: float = Field(default=0.9, env="SEMANTIC_CACHE_THRESHOLD")
+    semantic_cache_max_entries: int = Field(default=1000, env="SEMANTIC_CACHE_MAX_ENTRIES")
+    embedding_model: str = Field(default="all-MiniLM-L6-v2", env="EMBEDDING_MODEL")
     
     class Config:
         env_file = ".env"
         case_sensitive = False
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Load settings from the environment and .env once per process"""
+    return Settings()
+
+
+settings = get_settings()
+
+
+# Context window sizes in tokens, used to keep prompt + completion within limits.
+# Models not listed here are sent with MAX_TOKENS unchanged.
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106-preview": 128000,
+    "gpt-4-0125-preview": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-4.1-mini": 1047576,
+    "gpt-4.1-nano": 1047576,
+    "gpt-4.5-preview": 128000,
+    "gpt-5": 400000,
+    "gpt-5-mini": 400000,
+    "gpt-5-nano": 400000,
+    "o1": 200000,
+    "o1-mini": 128000,
+    "o1-preview": 128000,
+    "o3": 200000,
+    "o3-mini": 200000,
+    "o4-mini": 200000,
+    "gpt-3.5-turbo": 16385,
+}
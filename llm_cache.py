@@ -0,0 +1,123 @@
+"""Exact-match prompt/response cache for LLM calls"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Optional
+from langchain_core.messages import AIMessage
+from config import settings
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize a prompt so equivalent strings share a cache entry"""
+    return unicodedata.normalize("NFC", prompt).strip()
+
+
+def cache_key(prompt: str) -> str:
+    """Build a deterministic key from the model settings and prompt"""
+    payload = {
+        "m": settings.model_name,
+        "t": settings.temperature,
+        "mx": settings.max_tokens,
+        "p": prompt
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def is_truncated(response) -> bool:
+    """Whether a response stopped at its max_tokens limit rather than finishing"""
+    return getattr(response, "response_metadata", {}).get("finish_reason") == "length"
+
+
+class _Flight:
+    """A shared fetch task and the number of callers awaiting it"""
+    
+    __slots__ = ("task", "waiters")
+    
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+# Fetches currently in progress, keyed by cache key
+_inflight: Dict[str, _Flight] = {}
+
+
+async def get_or_fetch(key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    """Share one in-flight fetch between concurrent callers with the same key"""
+    flight = _inflight.get(key)
+    if flight is None:
+        # Detached from the first caller's task so its cancellation stays its own
+        flight = _Flight(asyncio.ensure_future(fetch()))
+        _inflight[key] = flight
+        flight.task.add_done_callback(
+            lambda _: _inflight.pop(key, None) if _inflight.get(key) is flight else None
+        )
+    
+    flight.waiters += 1
+    try:
+        return await asyncio.shield(flight.task)
+    except asyncio.CancelledError:
+        # Only abandon the fetch once its last waiter has gone
+        if flight.waiters == 1 and not flight.task.done():
+            flight.task.cancel()
+        raise
+    finally:
+        flight.waiters -= 1
+
+
+class CachedLLM:
+    """Wraps a chat model with a SQLite-backed response cache"""
+    
+    def __init__(self, llm, path: str = settings.cache_path):
+        self.llm = llm
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (k TEXT PRIMARY KEY, content TEXT NOT NULL)"
+        )
+        self.conn.commit()
+    
+    def get(self, key: str) -> Optional[AIMessage]:
+        """Return the cached response for a key, if any"""
+        row = self.conn.execute("SELECT content FROM cache WHERE k=?", (key,)).fetchone()
+        if row is None:
+            return None
+        return AIMessage(content=row[0])
+    
+    def put(self, key: str, content: str):
+        """Store a response under a key"""
+        self.conn.execute("INSERT OR REPLACE INTO cache (k, content) VALUES (?, ?)", (key, content))
+        self.conn.commit()
+    
+    def invoke(self, prompt: str, **kwargs) -> AIMessage:
+        """Return a cached response or call the model and cache the result"""
+        prompt = normalize_prompt(prompt)
+        key = cache_key(prompt)
+        
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        
+        response = self.llm.invoke(prompt, **kwargs)
+        if not is_truncated(response):
+            self.put(key, response.content)
+        return response
+    
+    async def ainvoke(self, prompt: str, **kwargs) -> AIMessage:
+        """Async variant of invoke that also coalesces concurrent identical misses"""
+        prompt = normalize_prompt(prompt)
+        key = cache_key(prompt)
+        
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        
+        async def fetch() -> AIMessage:
+            response = await self.llm.ainvoke(prompt, **kwargs)
+            if not is_truncated(response):
+                self.put(key, response.content)
+            return response
+        
+        return await get_or_fetch(key, fetch)
@@ -1,8 +1,12 @@
+import inspect
 import logfire
 import logging
+import random
 import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import wraps
-from typing import Any, Callable
+from typing import Any, Callable, Optional
 from config import settings
 
 
@@ -14,73 +18,154 @@ if settings.enable_logging:
     )
 
 
+# Resolved once rather than per AgentLogger
+_LOG_LEVEL = logging.getLevelName(settings.log_level.upper())
+
+
+class _NullSpan:
+    """Stand-in span used when Logfire tracing is disabled"""
+    
+    def set_attribute(self, key: str, value: Any):
+        pass
+    
+    def is_recording(self) -> bool:
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+# Whether the current workflow was picked for tracing; None until decided
+_SAMPLED: ContextVar[Optional[bool]] = ContextVar("logfire_sampled", default=None)
+
+
+@contextmanager
+def maybe_span(name: str, root: bool = False, always: bool = False):
+    """Open a Logfire span for sampled workflows; root spans re-sample, always skips sampling"""
+    if not settings.enable_logging:
+        yield _NULL_SPAN
+        return
+    
+    token = None
+    sampled = _SAMPLED.get()
+    if root or sampled is None:
+        sampled = random.random() < settings.logfire_sample_rate
+        token = _SAMPLED.set(sampled)
+    
+    try:
+        if sampled or always:
+            with logfire.span(name) as span:
+                yield span
+        else:
+            yield _NULL_SPAN
+    finally:
+        if token is not None:
+            _SAMPLED.reset(token)
+
+
 class AgentLogger:
     """Custom logger for agent operations with Logfire integration"""
     
     def __init__(self, name: str):
         self.name = name
         self.logger = logging.getLogger(name)
-        self.logger.setLevel(getattr(logging, settings.log_level))
+        self.logger.setLevel(_LOG_LEVEL)
     
     def log_agent_start(self, agent_name: str, task: str, **kwargs):
         """Log when an agent starts working"""
-        with logfire.span(f"Agent Start - {agent_name}") as span:
-            span.set_attribute("agent_name", agent_name)
-            span.set_attribute("task", task)
-            for key, value in kwargs.items():
-                span.set_attribute(key, str(value))
-            self.logger.info(f"Agent {agent_name} started task: {task}")
+        with maybe_span(f"Agent Start - {agent_name}") as span:
+            if span.is_recording():
+                span.set_attribute("agent_name", agent_name)
+                span.set_attribute("task", task)
+                for key, value in kwargs.items():
+                    span.set_attribute(key, str(value))
+            self.logger.info("Agent %s started task: %s", agent_name, task)
     
     def log_agent_end(self, agent_name: str, result: Any, execution_time: float, **kwargs):
         """Log when an agent finishes working"""
-        with logfire.span(f"Agent End - {agent_name}") as span:
-            span.set_attribute("agent_name", agent_name)
-            span.set_attribute("execution_time_ms", execution_time)
-            span.set_attribute("result_type", type(result).__name__)
-            for key, value in kwargs.items():
-                span.set_attribute(key, str(value))
-            self.logger.info(f"Agent {agent_name} completed in {execution_time:.2f}ms")
+        with maybe_span(f"Agent End - {agent_name}") as span:
+            if span.is_recording():
+                span.set_attribute("agent_name", agent_name)
+                span.set_attribute("execution_time_ms", execution_time)
+                span.set_attribute("result_type", type(result).__name__)
+                for key, value in kwargs.items():
+                    span.set_attribute(key, str(value))
+            self.logger.info("Agent %s completed in %.2fms", agent_name, execution_time)
     
     def log_error(self, agent_name: str, error: Exception, context: str = ""):
         """Log agent errors"""
-        with logfire.span(f"Agent Error - {agent_name}") as span:
+        with maybe_span(f"Agent Error - {agent_name}", always=True) as span:
             span.set_attribute("agent_name", agent_name)
             span.set_attribute("error", str(error))
             span.set_attribute("context", context)
-            self.logger.error(f"Error in {agent_name}: {error}")
+            self.logger.error("Error in %s: %s", agent_name, error)
     
     def log_metrics(self, agent_name: str, metrics: dict):
         """Log performance metrics"""
         if settings.enable_metrics:
-            with logfire.span(f"Metrics - {agent_name}") as span:
+            with maybe_span(f"Metrics - {agent_name}") as span:
                 for key, value in metrics.items():
                     span.set_attribute(key, value)
-                self.logger.info(f"Metrics for {agent_name}: {metrics}")
+                self.logger.info("Metrics for %s: %s", agent_name, metrics)
 
 
-def track_agent_performance(agent_name: str) -> Callable:
-    """Decorator to track agent performance"""
+def stamp_elapsed(result: Any, elapsed_ms: float):
+    """Record elapsed time on an agent result, or its per-item share on each result of a batch"""
+    results = result if isinstance(result, list) else [result]
+    results = [item for item in results if hasattr(item, "elapsed_ms")]
+    if not results:
+        return
+    # Batch time is split so per-workflow stats aren't inflated by the batch size
+    share = elapsed_ms / len(results)
+    for item in results:
+        item.elapsed_ms = share
+
+
+def track_agent_performance(agent_name: str = None) -> Callable:
+    """Decorator to track agent performance, defaulting to the instance's agent name"""
     def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs) -> Any:
+                name = agent_name or args[0].name
+                start_time = time.perf_counter_ns()
+                
+                try:
+                    logger.log_agent_start(name, func.__name__, args=args, kwargs=kwargs)
+                    result = await func(*args, **kwargs)
+                    
+                    execution_time = (time.perf_counter_ns() - start_time) / 1e6  # Convert to ms
+                    stamp_elapsed(result, execution_time)
+                    logger.log_agent_end(name, result, execution_time)
+                    
+                    return result
+                except Exception as e:
+                    logger.log_error(name, e, context=func.__name__)
+                    raise
+            
+            return async_wrapper
+        
         @wraps(func)
         def wrapper(*args, **kwargs) -> Any:
-            logger = AgentLogger(__name__)
-            start_time = time.time()
+            name = agent_name or args[0].name
+            start_time = time.perf_counter_ns()
             
             try:
-                logger.log_agent_start(agent_name, func.__name__, args=str(args), kwargs=str(kwargs))
+                logger.log_agent_start(name, func.__name__, args=args, kwargs=kwargs)
                 result = func(*args, **kwargs)
                 
-                execution_time = (time.time() - start_time) * 1000  # Convert to ms
-                logger.log_agent_end(agent_name, result, execution_time)
+                execution_time = (time.perf_counter_ns() - start_time) / 1e6  # Convert to ms
+                stamp_elapsed(result, execution_time)
+                logger.log_agent_end(name, result, execution_time)
                 
                 return result
             except Exception as e:
-                logger.log_error(agent_name, e, context=func.__name__)
+                logger.log_error(name, e, context=func.__name__)
                 raise
         
         return wrapper
     return decorator
 
 
-# Create module-level logger
+# Create module-level logger, also shared by every decorated call
 logger = AgentLogger(__name__)
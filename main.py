@@ -1,12 +1,37 @@
 #!/usr/bin/env python3
 """Main entry point for Intelligent Agent System"""
 
-import json
 import argparse
+import asyncio
+import logging
 import sys
-from orchestrator import AgentOrchestrator, demo_workflow
-from logger import logger
-import logfire
+import orjson
+from batch_runner import BatchRunner
+from orchestrator import WorkflowResult, demo_workflow, get_orchestrator
+from logger import logger, maybe_span
+
+
+def load_topics(path: str) -> list:
+    """Read one topic per non-empty line from a file"""
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def stream_to_stdout(stream) -> WorkflowResult:
+    """Write streamed (stage, chunk) pairs to stdout and return the workflow result"""
+    current_stage = None
+    while True:
+        try:
+            stage, chunk = next(stream)
+        except StopIteration as done:
+            sys.stdout.write("\n")
+            return done.value
+        
+        if stage != current_stage:
+            sys.stdout.write(f"\n\n=== {stage.upper()} ===\n")
+            current_stage = stage
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
 
 
 def main():
@@ -20,6 +45,26 @@ def main():
         default="Artificial Intelligence and Machine Learning in Enterprise",
         help="Topic for agent workflow"
     )
+    parser.add_argument(
+        "--topics",
+        type=str,
+        help="File with one topic per line to run as a concurrent batch"
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit --topics through the OpenAI Batch API (slower, half the cost)"
+    )
+    parser.add_argument(
+        "--stage-batched",
+        action="store_true",
+        help="Run --topics one stage at a time, sending each stage as one batched LLM call"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream each stage's output to stdout as it is generated"
+    )
     parser.add_argument(
         "--demo",
         action="store_true",
@@ -32,30 +77,71 @@ def main():
     )
     
     args = parser.parse_args()
+    if args.batch and not args.topics:
+        parser.error("--batch requires --topics")
+    if args.stage_batched and not args.topics:
+        parser.error("--stage-batched requires --topics")
     
     try:
         logger.logger.info("=" * 60)
         logger.logger.info("Intelligent Agent System - Starting")
         logger.logger.info("=" * 60)
         
-        with logfire.span("Main Application Execution") as main_span:
-            main_span.set_attribute("mode", "demo" if args.demo else "workflow")
+        with maybe_span("Main Application Execution") as main_span:
+            if args.demo:
+                mode = "demo"
+            elif args.batch:
+                mode = "batch_api"
+            elif args.stage_batched:
+                mode = "stage_batched"
+            elif args.topics:
+                mode = "batch"
+            elif args.stream:
+                mode = "stream"
+            else:
+                mode = "workflow"
+            main_span.set_attribute("mode", mode)
             
             if args.demo:
                 logger.logger.info("Running in DEMO mode")
                 result = demo_workflow()
                 logger.logger.info("Demo completed successfully")
             else:
-                logger.logger.info(f"Running workflow for topic: {args.topic}")
-                orchestrator = AgentOrchestrator()
-                result = orchestrator.execute_workflow(args.topic)
+                orchestrator = get_orchestrator()
+                if args.batch:
+                    topics = load_topics(args.topics)
+                    logger.logger.info("Submitting %d topics to the Batch API from: %s", len(topics), args.topics)
+                    result = BatchRunner(orchestrator).run(topics)
+                elif args.stage_batched:
+                    topics = load_topics(args.topics)
+                    logger.logger.info("Running stage-batched workflows for %d topics from: %s", len(topics), args.topics)
+                    result = orchestrator.execute_batch(topics)
+                elif args.topics:
+                    topics = load_topics(args.topics)
+                    logger.logger.info("Running batch of %d topics from: %s", len(topics), args.topics)
+                    result = asyncio.run(orchestrator.aexecute_batch(topics))
+                elif args.stream:
+                    logger.logger.info("Streaming workflow for topic: %s", args.topic)
+                    result = stream_to_stdout(orchestrator.stream_workflow(args.topic))
+                else:
+                    logger.logger.info("Running workflow for topic: %s", args.topic)
+                    result = orchestrator.execute_workflow(args.topic)
                 
                 if args.stats:
                     logger.logger.info("\n" + "=" * 60)
                     logger.logger.info("WORKFLOW STATISTICS")
                     logger.logger.info("=" * 60)
                     stats = orchestrator.get_workflow_statistics()
-                    logger.logger.info(f"Statistics: {json.dumps(stats, indent=2)}")
+                    if logger.logger.isEnabledFor(logging.INFO):
+                        logger.logger.info("Statistics: %s", orjson.dumps(stats, option=orjson.OPT_INDENT_2).decode())
+                
+                # Batch modes drop failed topics rather than raising
+                if args.topics and len(result) < len(topics):
+                    logger.logger.error(
+                        "Application completed with %d of %d workflows failed",
+                        len(topics) - len(result), len(topics)
+                    )
+                    return 1
             
             logger.logger.info("\n" + "=" * 60)
             logger.logger.info("Application completed successfully")
@@ -64,7 +150,7 @@ def main():
             return 0
     
     except Exception as e:
-        logger.logger.error(f"Application error: {str(e)}", exc_info=True)
+        logger.logger.error("Application error: %s", e, exc_info=True)
         logger.log_error("MainApp", e, context="main")
         return 1
 
@@ -1,140 +1,420 @@
 """Agent Orchestrator - Coordinates multi-agent workflow"""
 
+import asyncio
+import functools
+import itertools
+import math
+import os
 import time
-from typing import Dict, List, Any
-from agents import ResearchAgent, AnalysisAgent, WriterAgent, ReviewAgent
-from logger import logger
-import logfire
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Generator, List, Any, Tuple
+import orjson
+from agents import AgentResult, ResearchAgent, AnalysisAgent, WriterAgent, ReviewAgent
+from config import settings
+from logger import logger, maybe_span, stamp_elapsed
+
+
+def _stage_elapsed_ms(results: List[AgentResult]) -> float:
+    """Sum the per-item shares of a batch stage's time stamped by the agent decorator"""
+    return sum(result.elapsed_ms for result in results if result is not None)
+
+
+def advance_workflows(workflows: List[Tuple[str, str, list]],
+                      results: List[AgentResult]) -> List[Tuple[str, str, list]]:
+    """Append each workflow's stage result, dropping workflows whose stage failed"""
+    return [
+        (workflow_id, topic, stages + [result])
+        for (workflow_id, topic, stages), result in zip(workflows, results)
+        if result is not None
+    ]
+
+
+@dataclass(slots=True)
+class WorkflowResult:
+    """Outputs and stage timings of one complete workflow"""
+    workflow_id: str
+    topic: str
+    research_output: AgentResult
+    analysis_output: AgentResult
+    writing_output: AgentResult
+    review_output: AgentResult
+    performance: Dict[str, float]
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize for history files"""
+        return {
+            "workflow_id": self.workflow_id,
+            "topic": self.topic,
+            "research_output": self.research_output.to_dict(),
+            "analysis_output": self.analysis_output.to_dict(),
+            "writing_output": self.writing_output.to_dict(),
+            "review_output": self.review_output.to_dict(),
+            "performance": dict(self.performance)
+        }
+
+
+_STAGES = ("research", "analysis", "writing", "review")
 
 
 class AgentOrchestrator:
     """Orchestrates multi-agent workflow with performance tracking"""
     
+    __slots__ = (
+        "research_agent", "analysis_agent", "writer_agent", "review_agent",
+        "workflow_history", "performance_metrics", "_workflow_counter", "_sink", "_stats"
+    )
+    
     def __init__(self):
         self.research_agent = ResearchAgent()
         self.analysis_agent = AnalysisAgent()
         self.writer_agent = WriterAgent()
         self.review_agent = ReviewAgent()
         
-        self.workflow_history = []
+        self.workflow_history = deque(maxlen=settings.history_max)
         self.performance_metrics = {}
+        
+        os.makedirs(settings.history_dir, exist_ok=True)
+        self._sink = open(
+            os.path.join(settings.history_dir, "AgentOrchestrator.jsonl"), "ab", buffering=1 << 16
+        )
+        self._workflow_counter = itertools.count(1)
+        
+        # Running aggregates so statistics never re-scan the history
+        self._stats = {
+            "count": 0,
+            "sum_total": 0.0,
+            "per_agent": {
+                name: {"count": 0, "sum": 0.0, "min": math.inf, "max": 0.0}
+                for name in _STAGES
+            }
+        }
+    
+    def new_workflow_id(self) -> str:
+        """Build a workflow id that stays unique across concurrent workflows"""
+        return f"workflow_{int(time.time())}_{next(self._workflow_counter)}"
     
-    def execute_workflow(self, topic: str) -> Dict[str, Any]:
+    def execute_workflow(self, topic: str) -> WorkflowResult:
         """Execute complete multi-agent workflow"""
-        workflow_start = time.time()
-        workflow_id = f"workflow_{int(time.time())}"
+        workflow_start = time.perf_counter_ns()
+        workflow_id = self.new_workflow_id()
         
-        logger.logger.info(f"Starting workflow {workflow_id} for topic: {topic}")
+        logger.logger.info("Starting workflow %s for topic: %s", workflow_id, topic)
         
-        with logfire.span("Complete Agent Workflow") as workflow_span:
+        with maybe_span("Complete Agent Workflow", root=True) as workflow_span:
             workflow_span.set_attribute("workflow_id", workflow_id)
             workflow_span.set_attribute("topic", topic)
             
             # Stage 1: Research
             logger.logger.info("Stage 1: Research Agent Processing")
-            research_start = time.time()
             
-            with logfire.span("Research Stage"):
+            with maybe_span("Research Stage"):
                 research_result = self.research_agent.execute(topic)
-                research_time = (time.time() - research_start) * 1000
-                logger.log_metrics("ResearchAgent", {"execution_time_ms": research_time})
+                logger.log_metrics("ResearchAgent", {"execution_time_ms": research_result.elapsed_ms})
             
             # Stage 2: Analysis
             logger.logger.info("Stage 2: Analysis Agent Processing")
-            analysis_start = time.time()
             
-            with logfire.span("Analysis Stage"):
-                research_findings = research_result.get("findings", "")
+            with maybe_span("Analysis Stage"):
+                research_findings = research_result.findings
                 analysis_result = self.analysis_agent.execute(research_findings)
-                analysis_time = (time.time() - analysis_start) * 1000
-                logger.log_metrics("AnalysisAgent", {"execution_time_ms": analysis_time})
+                logger.log_metrics("AnalysisAgent", {"execution_time_ms": analysis_result.elapsed_ms})
             
             # Stage 3: Writing
             logger.logger.info("Stage 3: Writer Agent Processing")
-            writing_start = time.time()
             
-            with logfire.span("Writing Stage"):
-                analysis_insights = analysis_result.get("insights", "")
+            with maybe_span("Writing Stage"):
+                analysis_insights = analysis_result.insights
                 writing_result = self.writer_agent.execute(analysis_insights)
-                writing_time = (time.time() - writing_start) * 1000
-                logger.log_metrics("WriterAgent", {"execution_time_ms": writing_time})
+                logger.log_metrics("WriterAgent", {"execution_time_ms": writing_result.elapsed_ms})
             
             # Stage 4: Review
             logger.logger.info("Stage 4: Review Agent Processing")
-            review_start = time.time()
             
-            with logfire.span("Review Stage"):
-                report_content = writing_result.get("content", "")
+            with maybe_span("Review Stage"):
+                report_content = writing_result.content
                 review_result = self.review_agent.execute(report_content)
-                review_time = (time.time() - review_start) * 1000
-                logger.log_metrics("ReviewAgent", {"execution_time_ms": review_time})
-            
-            # Compile results
-            total_workflow_time = (time.time() - workflow_start) * 1000
-            
-            workflow_result = {
-                "workflow_id": workflow_id,
-                "topic": topic,
-                "research_output": research_result,
-                "analysis_output": analysis_result,
-                "writing_output": writing_result,
-                "review_output": review_result,
-                "performance": {
-                    "research_time_ms": research_time,
-                    "analysis_time_ms": analysis_time,
-                    "writing_time_ms": writing_time,
-                    "review_time_ms": review_time,
-                    "total_time_ms": total_workflow_time
-                }
-            }
+                logger.log_metrics("ReviewAgent", {"execution_time_ms": review_result.elapsed_ms})
+            
+            return self.compile_workflow(
+                workflow_id, topic, workflow_start,
+                (research_result, analysis_result, writing_result, review_result)
+            )
+    
+    async def aexecute_workflow(self, topic: str) -> WorkflowResult:
+        """Execute complete multi-agent workflow asynchronously"""
+        workflow_start = time.perf_counter_ns()
+        workflow_id = self.new_workflow_id()
+        
+        logger.logger.info("Starting workflow %s for topic: %s", workflow_id, topic)
+        
+        with maybe_span("Complete Agent Workflow", root=True) as workflow_span:
+            workflow_span.set_attribute("workflow_id", workflow_id)
+            workflow_span.set_attribute("topic", topic)
+            
+            # Stage 1: Research
+            logger.logger.info("Stage 1: Research Agent Processing")
+            
+            with maybe_span("Research Stage"):
+                research_result = await self.research_agent.aexecute(topic)
+                logger.log_metrics("ResearchAgent", {"execution_time_ms": research_result.elapsed_ms})
             
-            self.workflow_history.append(workflow_result)
-            logger.log_metrics("Orchestrator", workflow_result["performance"])
+            # Stage 2: Analysis
+            logger.logger.info("Stage 2: Analysis Agent Processing")
+            
+            with maybe_span("Analysis Stage"):
+                research_findings = research_result.findings
+                analysis_result = await self.analysis_agent.aexecute(research_findings)
+                logger.log_metrics("AnalysisAgent", {"execution_time_ms": analysis_result.elapsed_ms})
+            
+            # Stage 3: Writing
+            logger.logger.info("Stage 3: Writer Agent Processing")
             
-            logger.logger.info(f"Workflow {workflow_id} completed in {total_workflow_time:.2f}ms")
+            with maybe_span("Writing Stage"):
+                analysis_insights = analysis_result.insights
+                writing_result = await self.writer_agent.aexecute(analysis_insights)
+                logger.log_metrics("WriterAgent", {"execution_time_ms": writing_result.elapsed_ms})
             
-            return workflow_result
+            # Stage 4: Review
+            logger.logger.info("Stage 4: Review Agent Processing")
+            
+            with maybe_span("Review Stage"):
+                report_content = writing_result.content
+                review_result = await self.review_agent.aexecute(report_content)
+                logger.log_metrics("ReviewAgent", {"execution_time_ms": review_result.elapsed_ms})
+            
+            return self.compile_workflow(
+                workflow_id, topic, workflow_start,
+                (research_result, analysis_result, writing_result, review_result)
+            )
+    
+    async def aexecute_batch(self, topics: List[str]) -> List[WorkflowResult]:
+        """Execute workflows for several topics concurrently, returning the ones that succeed"""
+        semaphore = asyncio.Semaphore(settings.num_concurrent)
+        
+        async def run(topic: str) -> WorkflowResult:
+            async with semaphore:
+                return await self.aexecute_workflow(topic)
+        
+        logger.logger.info("Starting batch of %d workflows", len(topics))
+        outcomes = await asyncio.gather(*(run(topic) for topic in topics), return_exceptions=True)
+        
+        # A failed topic is logged and dropped rather than discarding the whole batch
+        results = []
+        for topic, outcome in zip(topics, outcomes):
+            if isinstance(outcome, Exception):
+                logger.log_error("Orchestrator", outcome, context=f"batch workflow: {topic}")
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            else:
+                results.append(outcome)
+        
+        if len(results) < len(topics):
+            logger.logger.warning("%d of %d batch workflows failed", len(topics) - len(results), len(topics))
+        return results
+    
+    def execute_batch(self, topics: List[str]) -> List[WorkflowResult]:
+        """Execute workflows for several topics one stage at a time across all topics"""
+        if not topics:
+            return []
+        
+        workflow_start = time.perf_counter_ns()
+        workflow_ids = [self.new_workflow_id() for _ in topics]
+        
+        logger.logger.info("Starting stage-batched run of %d workflows", len(topics))
+        
+        with maybe_span("Batched Agent Workflow", root=True) as batch_span:
+            batch_span.set_attribute("workflow_ids", workflow_ids)
+            
+            # (workflow_id, topic, stage results) for workflows still running
+            workflows = [(workflow_id, topic, []) for workflow_id, topic in zip(workflow_ids, topics)]
+            
+            # Stage 1: Research
+            logger.logger.info("Stage 1: Research Agent Processing")
+            
+            with maybe_span("Research Stage"):
+                research_results = self.research_agent.execute_many(topics)
+                logger.log_metrics("ResearchAgent", {"execution_time_ms": _stage_elapsed_ms(research_results)})
+                workflows = advance_workflows(workflows, research_results)
+            
+            # Stage 2: Analysis
+            logger.logger.info("Stage 2: Analysis Agent Processing")
+            
+            with maybe_span("Analysis Stage"):
+                analysis_results = self.analysis_agent.execute_many(
+                    [stages[-1].findings for _, _, stages in workflows]
+                )
+                logger.log_metrics("AnalysisAgent", {"execution_time_ms": _stage_elapsed_ms(analysis_results)})
+                workflows = advance_workflows(workflows, analysis_results)
+            
+            # Stage 3: Writing
+            logger.logger.info("Stage 3: Writer Agent Processing")
+            
+            with maybe_span("Writing Stage"):
+                writing_results = self.writer_agent.execute_many(
+                    [stages[-1].insights for _, _, stages in workflows]
+                )
+                logger.log_metrics("WriterAgent", {"execution_time_ms": _stage_elapsed_ms(writing_results)})
+                workflows = advance_workflows(workflows, writing_results)
+            
+            # Stage 4: Review
+            logger.logger.info("Stage 4: Review Agent Processing")
+            
+            with maybe_span("Review Stage"):
+                review_results = self.review_agent.execute_many(
+                    [stages[-1].content for _, _, stages in workflows]
+                )
+                logger.log_metrics("ReviewAgent", {"execution_time_ms": _stage_elapsed_ms(review_results)})
+                workflows = advance_workflows(workflows, review_results)
+            
+            if len(workflows) < len(topics):
+                logger.logger.warning(
+                    "%d of %d stage-batched workflows failed", len(topics) - len(workflows), len(topics)
+                )
+            if not workflows:
+                return []
+            
+            # Each completed workflow is charged its share of the whole batch
+            total_time_ms = (time.perf_counter_ns() - workflow_start) / 1e6 / len(workflows)
+            return [
+                self.compile_workflow(workflow_id, topic, workflow_start, tuple(stages), total_time_ms)
+                for workflow_id, topic, stages in workflows
+            ]
+    
+    def stream_workflow(self, topic: str) -> Generator[Tuple[str, str], None, WorkflowResult]:
+        """Execute the workflow, yielding (stage, chunk) pairs as each stage streams"""
+        workflow_start = time.perf_counter_ns()
+        workflow_id = self.new_workflow_id()
+        
+        logger.logger.info("Starting streamed workflow %s for topic: %s", workflow_id, topic)
+        
+        with maybe_span("Streamed Agent Workflow", root=True) as workflow_span:
+            workflow_span.set_attribute("workflow_id", workflow_id)
+            workflow_span.set_attribute("topic", topic)
+            
+            research_result = yield from self._stream_stage("research", self.research_agent, topic)
+            analysis_result = yield from self._stream_stage(
+                "analysis", self.analysis_agent, research_result.findings
+            )
+            writing_result = yield from self._stream_stage(
+                "writing", self.writer_agent, analysis_result.insights
+            )
+            review_result = yield from self._stream_stage(
+                "review", self.review_agent, writing_result.content
+            )
+            
+            return self.compile_workflow(
+                workflow_id, topic, workflow_start,
+                (research_result, analysis_result, writing_result, review_result)
+            )
+    
+    def _stream_stage(self, stage: str, agent,
+                      input_data: str) -> Generator[Tuple[str, str], None, AgentResult]:
+        """Stream one stage's chunks and return the agent output once complete"""
+        stage_start = time.perf_counter_ns()
+        parts = []
+        
+        with maybe_span(f"{stage.capitalize()} Stage"):
+            for chunk in agent.stream_execute(agent.build_prompt(input_data)):
+                parts.append(chunk)
+                yield stage, chunk
+            
+            result = agent.build_result(input_data, "".join(parts))
+            agent.record(result)
+            stamp_elapsed(result, (time.perf_counter_ns() - stage_start) / 1e6)
+            logger.log_metrics(agent.name, {"execution_time_ms": result.elapsed_ms})
+        
+        return result
+    
+    def compile_workflow(self, workflow_id: str, topic: str, workflow_start: int,
+                         results: tuple, total_time_ms: float = None) -> WorkflowResult:
+        """Compile stage results into a workflow result and record it"""
+        research_result, analysis_result, writing_result, review_result = results
+        total_workflow_time = total_time_ms
+        if total_workflow_time is None:
+            total_workflow_time = (time.perf_counter_ns() - workflow_start) / 1e6
+        
+        workflow_result = WorkflowResult(
+            workflow_id=workflow_id,
+            topic=topic,
+            research_output=research_result,
+            analysis_output=analysis_result,
+            writing_output=writing_result,
+            review_output=review_result,
+            performance={
+                "research_time_ms": research_result.elapsed_ms,
+                "analysis_time_ms": analysis_result.elapsed_ms,
+                "writing_time_ms": writing_result.elapsed_ms,
+                "review_time_ms": review_result.elapsed_ms,
+                "total_time_ms": total_workflow_time
+            }
+        )
+        
+        self.workflow_history.append(workflow_result)
+        self._update_stats(workflow_result.performance)
+        self._sink.write(orjson.dumps(workflow_result.to_dict()) + b"\n")
+        logger.log_metrics("Orchestrator", workflow_result.performance)
+        
+        logger.logger.info("Workflow %s completed in %.2fms", workflow_id, total_workflow_time)
+        
+        return workflow_result
+    
+    def close(self):
+        """Flush and close the orchestrator's and agents' history files"""
+        self._sink.close()
+        for agent in (self.research_agent, self.analysis_agent, self.writer_agent, self.review_agent):
+            agent.close()
+    
+    def _update_stats(self, performance: Dict[str, float]):
+        """Fold one workflow's timings into the running aggregates"""
+        self._stats["count"] += 1
+        self._stats["sum_total"] += performance["total_time_ms"]
+        
+        for name, agent_stats in self._stats["per_agent"].items():
+            elapsed = performance[f"{name}_time_ms"]
+            agent_stats["count"] += 1
+            agent_stats["sum"] += elapsed
+            agent_stats["min"] = min(agent_stats["min"], elapsed)
+            agent_stats["max"] = max(agent_stats["max"], elapsed)
     
     def get_workflow_statistics(self) -> Dict[str, Any]:
         """Get statistics from completed workflows"""
-        if not self.workflow_history:
+        total_workflows = self._stats["count"]
+        if not total_workflows:
             return {"message": "No workflows completed yet"}
         
-        total_workflows = len(self.workflow_history)
-        avg_total_time = sum(
-            w["performance"]["total_time_ms"] for w in self.workflow_history
-        ) / total_workflows
-        
         return {
             "total_workflows": total_workflows,
-            "average_workflow_time_ms": avg_total_time,
-            "workflows": [w["workflow_id"] for w in self.workflow_history]
+            "average_workflow_time_ms": self._stats["sum_total"] / total_workflows,
+            # Only the most recent workflows are still held in history
+            "workflows": [w.workflow_id for w in self.workflow_history]
         }
     
     def get_agent_performance(self, agent_name: str) -> Dict[str, Any]:
         """Get performance metrics for a specific agent"""
-        agent_key = f"{agent_name.lower()}_time_ms"
-        
-        times = []
-        for workflow in self.workflow_history:
-            if agent_key in workflow["performance"]:
-                times.append(workflow["performance"][agent_key])
+        agent_stats = self._stats["per_agent"].get(agent_name.lower())
         
-        if not times:
+        if not agent_stats or not agent_stats["count"]:
             return {"message": f"No data for {agent_name}"}
         
         return {
             "agent": agent_name,
-            "executions": len(times),
-            "average_time_ms": sum(times) / len(times),
-            "min_time_ms": min(times),
-            "max_time_ms": max(times)
+            "executions": agent_stats["count"],
+            "average_time_ms": agent_stats["sum"] / agent_stats["count"],
+            "min_time_ms": agent_stats["min"],
+            "max_time_ms": agent_stats["max"]
         }
 
 
+@functools.lru_cache(maxsize=1)
+def get_orchestrator() -> AgentOrchestrator:
+    """Get the process-wide orchestrator, built on first use"""
+    return AgentOrchestrator()
+
+
 def demo_workflow():
     """Demo workflow execution"""
-    orchestrator = AgentOrchestrator()
+    orchestrator = get_orchestrator()
     
     # Execute workflow
     result = orchestrator.execute_workflow(
@@ -144,6 +424,6 @@ def demo_workflow():
     # Print statistics
     logger.logger.info("\n=== Workflow Statistics ===")
     stats = orchestrator.get_workflow_statistics()
-    logger.logger.info(f"Statistics: {stats}")
+    logger.logger.info("Statistics: %s", stats)
     
     return result
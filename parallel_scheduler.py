@@ -0,0 +1,230 @@
+"""Rate-limit-aware scheduler for concurrent LLM requests"""
+
+import asyncio
+import weakref
+from dataclasses import dataclass
+from typing import Any, List, Optional
+import tiktoken
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from config import MODEL_CONTEXT_WINDOWS, settings
+from logger import logger
+
+
+def _load_encoding(model_name: str) -> tiktoken.Encoding:
+    """Load the tokenizer for a model, falling back to cl100k_base"""
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+encoding = _load_encoding(settings.model_name)
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens in text with the configured model's tokenizer"""
+    return len(encoding.encode(text))
+
+
+# Headroom for chat message framing tokens
+_FRAMING_TOKENS = 64
+
+# Smallest completion worth requesting once the prompt is accounted for
+_MIN_COMPLETION_TOKENS = 256
+
+
+def context_window(model_name: str) -> Optional[int]:
+    """Context window of the longest known model name matching model_name, if any"""
+    # Only whole names or dated snapshots match, so gpt-4 doesn't absorb gpt-4.1
+    matches = [
+        name for name in MODEL_CONTEXT_WINDOWS
+        if model_name == name or model_name.startswith(name + "-")
+    ]
+    if not matches:
+        return None
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)]
+
+
+# Dated snapshots (e.g. gpt-4o-2024-08-06) resolve to their family's window
+_CONTEXT_WINDOW = context_window(settings.model_name)
+
+
+def completion_budget(prompt_tokens: int) -> int:
+    """Largest max_tokens that fits alongside the prompt in the model's context window"""
+    if _CONTEXT_WINDOW is None:
+        # Unknown window; leave sizing to the API rather than guess
+        return settings.max_tokens
+    
+    budget = min(settings.max_tokens, _CONTEXT_WINDOW - prompt_tokens - _FRAMING_TOKENS)
+    if budget < min(settings.max_tokens, _MIN_COMPLETION_TOKENS):
+        raise ValueError(
+            f"Prompt of {prompt_tokens} tokens leaves only {budget} completion tokens "
+            f"in the {_CONTEXT_WINDOW}-token context window of {settings.model_name}"
+        )
+    return budget
+
+
+def budgeted(llm, prompt_tokens: int):
+    """Bind a smaller max_tokens to the model when the prompt would overflow the context"""
+    max_tokens = completion_budget(prompt_tokens)
+    if max_tokens == settings.max_tokens:
+        return llm
+    return llm.bind(max_tokens=max_tokens)
+
+
+# Failures worth another attempt; the scheduled client itself is built without retries
+_RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+
+@dataclass
+class Request:
+    """A prompt waiting for rate-limit capacity"""
+    prompt: str
+    llm: Any
+    n_tokens: int = 0
+    future: Optional[asyncio.Future] = None
+    attempt: int = 0
+    
+    def __post_init__(self):
+        if not self.n_tokens:
+            # Budget for the completion as well, as the API does
+            self.n_tokens = count_tokens(self.prompt) + settings.max_tokens
+
+
+class TokenBucket:
+    """Per-minute capacity refilled in one-second increments"""
+    
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.available = float(per_minute)
+    
+    def refill(self):
+        self.available = min(self.capacity, self.available + self.capacity / 60)
+
+
+class ParallelScheduler:
+    """Producer/consumer queue that dispatches requests within RPM and TPM limits"""
+    
+    def __init__(self, max_requests_per_minute: int, max_tokens_per_minute: int,
+                 max_retries: int):
+        self.rpm = TokenBucket(max_requests_per_minute)
+        self.tpm = TokenBucket(max_tokens_per_minute)
+        self.max_retries = max_retries
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._refilled = asyncio.Event()
+        self._tasks = set()
+        self._worker = None
+    
+    def _ensure_started(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+            self._tasks.add(asyncio.create_task(self._refill()))
+    
+    async def _refill(self):
+        while True:
+            await asyncio.sleep(1)
+            self.rpm.refill()
+            self.tpm.refill()
+            self._refilled.set()
+    
+    async def _run(self):
+        while True:
+            request = await self.queue.get()
+            if request.future.done():
+                # The caller gave up; don't spend capacity on it
+                continue
+            
+            # Oversized requests wait for a full bucket rather than forever
+            tokens = min(request.n_tokens, self.tpm.capacity)
+            
+            while self.rpm.available < 1 or self.tpm.available < tokens:
+                self._refilled.clear()
+                await self._refilled.wait()
+            
+            self.rpm.available -= 1
+            self.tpm.available -= tokens
+            
+            task = asyncio.create_task(self._dispatch(request))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _dispatch(self, request: Request):
+        try:
+            response = await request.llm.ainvoke(request.prompt)
+        except _RETRYABLE_ERRORS as e:
+            if request.attempt >= self.max_retries:
+                if not request.future.done():
+                    request.future.set_exception(e)
+                return
+            
+            delay = 2 ** request.attempt
+            request.attempt += 1
+            logger.logger.warning(
+                "%s, retrying in %ds (attempt %d/%d)",
+                type(e).__name__, delay, request.attempt, self.max_retries
+            )
+            await asyncio.sleep(delay)
+            self.queue.put_nowait(request)
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(response)
+    
+    async def schedule(self, requests: List[Request]) -> List[Any]:
+        """Queue requests and wait for all of their responses"""
+        loop = asyncio.get_running_loop()
+        for request in requests:
+            request.future = loop.create_future()
+            self.queue.put_nowait(request)
+        
+        self._ensure_started()
+        return await asyncio.gather(*(request.future for request in requests))
+
+
+# One scheduler per event loop, so limits are shared by every agent on it
+_schedulers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ParallelScheduler]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_scheduler() -> ParallelScheduler:
+    """Get the scheduler bound to the running event loop"""
+    loop = asyncio.get_running_loop()
+    if loop not in _schedulers:
+        _schedulers[loop] = ParallelScheduler(
+            max_requests_per_minute=settings.max_requests_per_minute,
+            max_tokens_per_minute=settings.max_tokens_per_minute,
+            max_retries=settings.max_retries
+        )
+    return _schedulers[loop]
+
+
+async def schedule(requests: List[Request]) -> List[Any]:
+    """Dispatch requests through the running loop's rate-limited scheduler"""
+    return await get_scheduler().schedule(requests)
+
+
+class ScheduledLLM:
+    """Chat model wrapper that sizes max_tokens per prompt and schedules async calls"""
+    
+    def __init__(self, llm, scheduled_llm=None):
+        self.llm = llm
+        # Model used for scheduled calls; defaults to the sync model
+        self.scheduled_llm = scheduled_llm or llm
+    
+    def invoke(self, prompt: str, prompt_tokens: int = 0):
+        prompt_tokens = prompt_tokens or count_tokens(prompt)
+        return budgeted(self.llm, prompt_tokens).invoke(prompt)
+    
+    async def ainvoke(self, prompt: str, prompt_tokens: int = 0):
+        # A precomputed prompt count skips re-tokenizing the full prompt
+        prompt_tokens = prompt_tokens or count_tokens(prompt)
+        request = Request(
+            prompt=prompt,
+            llm=budgeted(self.scheduled_llm, prompt_tokens),
+            n_tokens=prompt_tokens + completion_budget(prompt_tokens)
+        )
+        responses = await schedule([request])
+        return responses[0]
@@ -0,0 +1,64 @@
+"""Semantic cache that reuses responses for near-duplicate prompts"""
+
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+import faiss
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from config import settings
+
+
+@lru_cache(maxsize=1)
+def _get_encoder(model_name: str) -> SentenceTransformer:
+    """Load the embedding model once per process"""
+    return SentenceTransformer(model_name)
+
+
+class SemanticCache:
+    """Cosine-similarity cache over input embeddings, one per agent namespace"""
+    
+    def __init__(self, namespace: str, threshold: float = settings.semantic_cache_threshold,
+                 max_entries: int = settings.semantic_cache_max_entries):
+        self.namespace = namespace
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.encoder = _get_encoder(settings.embedding_model)
+        # Explicit ids let the oldest entry be evicted without renumbering the rest
+        self.index = faiss.IndexIDMap(
+            faiss.IndexFlatIP(self.encoder.get_sentence_embedding_dimension())
+        )
+        self.entries: Dict[int, Tuple[str, Dict[str, Any]]] = {}
+        self._next_id = 0
+    
+    def fits(self, text: str) -> bool:
+        """Whether text fits the encoder unclipped; longer inputs would embed only their head"""
+        limit = self.encoder.max_seq_length
+        # Leave room for the tokenizer's special tokens
+        return limit is None or len(self.encoder.tokenizer.tokenize(text)) <= limit - 2
+    
+    def embed(self, text: str) -> np.ndarray:
+        """Embed text as a normalized float32 row vector"""
+        vector = self.encoder.encode([text], normalize_embeddings=True)
+        return np.asarray(vector, dtype="float32")
+    
+    def lookup(self, vector: np.ndarray) -> Optional[str]:
+        """Return the closest cached content above threshold, if any"""
+        if self.index.ntotal == 0:
+            return None
+        
+        scores, ids = self.index.search(vector, 1)
+        if scores[0][0] >= self.threshold:
+            content, _ = self.entries[int(ids[0][0])]
+            return content
+        return None
+    
+    def add(self, vector: np.ndarray, content: str, meta: Dict[str, Any]):
+        """Store a response under its input embedding, evicting the oldest when full"""
+        if len(self.entries) >= self.max_entries:
+            oldest = next(iter(self.entries))
+            self.index.remove_ids(np.array([oldest], dtype="int64"))
+            del self.entries[oldest]
+        
+        self.index.add_with_ids(vector, np.array([self._next_id], dtype="int64"))
+        self.entries[self._next_id] = (content, meta)
+        self._next_id += 1
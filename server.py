@@ -0,0 +1,36 @@
+"""HTTP server reusing one orchestrator across requests (run with: uvicorn server:app)"""
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from pydantic import BaseModel
+from orchestrator import get_orchestrator
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the orchestrator before serving and flush its history files on shutdown"""
+    # Built here so threadpool and event-loop handlers never race to create it
+    orchestrator = get_orchestrator()
+    yield
+    orchestrator.close()
+
+
+app = FastAPI(title="Intelligent Agent System", lifespan=lifespan)
+
+
+class WorkflowRequest(BaseModel):
+    """Request body for running a workflow"""
+    topic: str
+
+
+@app.post("/workflow")
+async def run_workflow(request: WorkflowRequest) -> dict:
+    """Run the multi-agent workflow for a topic"""
+    result = await get_orchestrator().aexecute_workflow(request.topic)
+    return result.to_dict()
+
+
+@app.get("/stats")
+async def workflow_statistics() -> dict:
+    """Get statistics from completed workflows, on the loop thread that updates them"""
+    return get_orchestrator().get_workflow_statistics()